@@ -10,27 +10,37 @@ Zotero 本地文献索引器
 
 import os
 import re
-import json
-import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from typing import Optional
 
-import yaml
+import orjson
 import fitz  # PyMuPDF
+import xxhash
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
 
-from llama_index.core import (
-    Document,
-    VectorStoreIndex,
-    StorageContext,
-    Settings,
-)
+from llama_index.core import Document, VectorStoreIndex
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.ollama import OllamaEmbedding
+from llama_index.core.schema import MetadataMode
+
+from rag_utils import (
+    CachedOllamaEmbedding,
+    DEFAULT_EMBED_BATCH_SIZE,
+    EmbeddingCache,
+    PooledOllamaEmbedding,
+    build_ann_index,
+    delete_paper_chunks,
+    get_vector_store,
+    load_config,
+    optimize_vector_store,
+    reset_vector_store,
+    vector_store_exists,
+)
 
 # 尝试导入元数据模块
 try:
@@ -41,8 +51,22 @@ except ImportError:
 
 console = Console()
 
+# 文件名格式: 作者 - 年份 - 标题
+_FILENAME_RE = re.compile(r'^(.+?)\s*[-–—]\s*(\d{4})\s*[-–—]\s*(.+)$')
+# Zotero storage 子目录名（8 位 key）
+_ZOTERO_KEY_RE = re.compile(r'^[A-Z0-9]{8}$')
+
+# 文本少于该字符数的页面（空白页、纯图片页）不建索引
+MIN_PAGE_CHARS = 50
+
+# 索引状态中记录的哈希算法，变更后旧记录全部失效
+HASH_ALGO = "xxh64"
+
+# 索引状态格式版本：2 起按单个 PDF（zotero_key/文件名）记录，而不是按 zotero_key
+STATE_VERSION = 2
+
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PaperInfo:
     """论文信息（从文件名解析 + Zotero 元数据）"""
     # 基础信息
@@ -61,11 +85,11 @@ class PaperInfo:
     volume: str = ""
     issue: str = ""
     pages: str = ""
-
-
-def load_config(config_path: str = "config.yaml") -> dict:
-    with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    
+    @property
+    def state_key(self) -> str:
+        """索引状态中的键：同一 storage 目录下可能有多个 PDF（补充材料、译文等）"""
+        return f"{self.zotero_key}/{self.file_path.name}"
 
 
 def get_zotero_storage_path(config: dict) -> Path:
@@ -80,8 +104,7 @@ def parse_filename(filename: str, zotero_key: str, file_path: Path) -> PaperInfo
     """解析 Zotero 文件名: 作者 - 年份 - 标题.pdf"""
     name = filename.rsplit('.', 1)[0] if filename.lower().endswith('.pdf') else filename
     
-    pattern = r'^(.+?)\s*[-–—]\s*(\d{4})\s*[-–—]\s*(.+)$'
-    match = re.match(pattern, name)
+    match = _FILENAME_RE.match(name)
     
     if match:
         authors = match.group(1).strip()
@@ -99,26 +122,24 @@ def parse_filename(filename: str, zotero_key: str, file_path: Path) -> PaperInfo
 
 
 def enrich_with_metadata(paper: PaperInfo, metadata: 'PaperMetadata') -> PaperInfo:
-    """用 Zotero 元数据丰富论文信息"""
-    # 优先使用数据库中的信息
-    if metadata.title:
-        paper.title = metadata.title
-    if metadata.authors:
-        paper.authors = ", ".join(metadata.authors)
-    if metadata.year:
-        paper.year = metadata.year
-    
-    # 附加信息
-    paper.doi = metadata.doi
-    paper.journal = metadata.journal
-    paper.abstract = metadata.abstract
-    paper.tags = metadata.tags
-    paper.notes = metadata.notes
-    paper.volume = metadata.volume
-    paper.issue = metadata.issue
-    paper.pages = metadata.pages
-    
-    return paper
+    """用 Zotero 元数据丰富论文信息（PaperInfo 不可变，返回新对象）"""
+    return replace(
+        paper,
+        # 优先使用数据库中的信息
+        title=metadata.title or paper.title,
+        authors=", ".join(metadata.authors) if metadata.authors else paper.authors,
+        year=metadata.year or paper.year,
+        
+        # 附加信息
+        doi=metadata.doi,
+        journal=metadata.journal,
+        abstract=metadata.abstract,
+        tags=metadata.tags,
+        notes=metadata.notes,
+        volume=metadata.volume,
+        issue=metadata.issue,
+        pages=metadata.pages,
+    )
 
 
 def find_all_pdfs(storage_path: Path, attachment_map: dict = None) -> list[PaperInfo]:
@@ -129,23 +150,29 @@ def find_all_pdfs(storage_path: Path, attachment_map: dict = None) -> list[Paper
         console.print(f"[red]Storage 目录不存在: {storage_path}[/red]")
         return papers
     
-    for item_dir in storage_path.iterdir():
-        if not item_dir.is_dir():
-            continue
-        
-        zotero_key = item_dir.name
-        if not re.match(r'^[A-Z0-9]{8}$', zotero_key):
-            continue
-        
-        for pdf_file in item_dir.glob("*.pdf"):
-            paper = parse_filename(pdf_file.name, zotero_key, pdf_file)
+    # os.scandir 的 DirEntry 自带文件类型，省去逐个 stat
+    with os.scandir(storage_path) as it:
+        for entry in it:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
             
-            # 尝试用 Zotero 元数据丰富
-            if attachment_map and zotero_key in attachment_map:
-                metadata = attachment_map[zotero_key]
-                paper = enrich_with_metadata(paper, metadata)
+            zotero_key = entry.name
+            if not _ZOTERO_KEY_RE.match(zotero_key):
+                continue
             
-            papers.append(paper)
+            with os.scandir(entry.path) as sub:
+                for pdf_entry in sub:
+                    if not pdf_entry.name.lower().endswith(".pdf") or not pdf_entry.is_file():
+                        continue
+                    
+                    paper = parse_filename(pdf_entry.name, zotero_key, Path(pdf_entry.path))
+                    
+                    # 尝试用 Zotero 元数据丰富
+                    if attachment_map and zotero_key in attachment_map:
+                        metadata = attachment_map[zotero_key]
+                        paper = enrich_with_metadata(paper, metadata)
+                    
+                    papers.append(paper)
     
     return papers
 
@@ -153,11 +180,14 @@ def find_all_pdfs(storage_path: Path, attachment_map: dict = None) -> list[Paper
 def extract_pdf_by_pages(paper: PaperInfo) -> list[tuple[str, dict]]:
     """按页提取 PDF，包含丰富的元数据"""
     doc = fitz.open(paper.file_path)
+    total_pages = len(doc)
     
     pages = []
     for page_num, page in enumerate(doc):
-        text = page.get_text()
-        if text.strip():
+        # 一次取出整页文本块，丢弃图片块 (block_type != 0)
+        blocks = page.get_text("blocks")
+        text = "\n".join(b[4] for b in blocks if b[6] == 0)
+        if len(text) >= MIN_PAGE_CHARS and not text.isspace():
             meta = {
                 # 基础信息
                 "title": paper.title,
@@ -167,7 +197,7 @@ def extract_pdf_by_pages(paper: PaperInfo) -> list[tuple[str, dict]]:
                 "source": paper.file_path.name,
                 "file_path": str(paper.file_path),
                 "page": page_num + 1,
-                "total_pages": len(doc),
+                "total_pages": total_pages,
                 
                 # 扩展元数据
                 "doi": paper.doi,
@@ -184,51 +214,138 @@ def extract_pdf_by_pages(paper: PaperInfo) -> list[tuple[str, dict]]:
 
 
 def get_file_hash(filepath: Path) -> str:
-    hash_md5 = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    """文件内容哈希（xxh64，仅用于变更检测）"""
+    h = xxhash.xxh64()
+    with open(filepath, "rb", buffering=0) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_file_signature(filepath: Path) -> tuple[int, int]:
+    """文件签名 (size, mtime_ns)，用于在哈希前快速判断是否变化"""
+    st = filepath.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def _extract_one(paper: PaperInfo, known_hash: Optional[str] = None) -> tuple:
+    """计算文件哈希并提取 PDF（在子进程中运行）
+    
+    返回 (paper, pages, file_hash, error)。哈希与 known_hash 相同时
+    跳过解析，pages 为 None。
+    """
+    try:
+        file_hash = get_file_hash(paper.file_path)
+        if file_hash == known_hash:
+            return paper, None, file_hash, None
+        return paper, extract_pdf_by_pages(paper), file_hash, None
+    except Exception as e:
+        return paper, [], "", str(e)
+
+
+def _bounded_map(executor, fn, *iterables, max_pending: int):
+    """按提交顺序产出结果，同时最多保留 max_pending 个未消费的任务
+    
+    相当于解析进程与主线程之间的有界队列：解析与嵌入重叠进行，
+    嵌入较慢时也不会把整个文献库的文本堆积在内存中。
+    """
+    futures = deque()
+    for args in zip(*iterables):
+        futures.append(executor.submit(fn, *args))
+        if len(futures) >= max_pending:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def _embed_unique(embed_model, nodes: list):
+    """为节点计算嵌入，嵌入输入完全相同的块只请求一次
+    
+    按实际送入嵌入模型的文本（正文 + 嵌入元数据）分组，重复的页眉、
+    版权声明等块复用同一向量；已带向量的节点在 insert_nodes 时不会再嵌入。
+    """
+    texts = {}
+    groups = {}
+    for node in nodes:
+        text = node.get_content(metadata_mode=MetadataMode.EMBED)
+        key = xxhash.xxh64_hexdigest(text.encode())
+        if key not in groups:
+            texts[key] = text
+            groups[key] = []
+        groups[key].append(node)
+    
+    keys = list(groups)
+    embeddings = embed_model.get_text_embedding_batch([texts[k] for k in keys])
+    for key, embedding in zip(keys, embeddings):
+        for node in groups[key]:
+            node.embedding = embedding
+
+
+def _flush_batch(index: VectorStoreIndex, embed_model, nodes: list, batch: list, state: dict) -> tuple[int, int]:
+    """写入一批节点，成功后提交对应论文的索引状态
+    
+    返回 (论文数, 块数)，并清空 nodes 与 batch。
+    """
+    if not nodes and not batch:
+        return 0, 0
+    
+    chunk_count = len(nodes)
+    try:
+        _embed_unique(embed_model, nodes)
+        index.insert_nodes(nodes)
+    except Exception as e:
+        for paper, _ in batch:
+            console.print(f"  [red]✗[/red] {paper.file_path.name}: {e}")
+        nodes.clear()
+        batch.clear()
+        return 0, 0
+    
+    for paper, entry in batch:
+        state["indexed_files"][paper.state_key] = entry
+    
+    paper_count = len(batch)
+    nodes.clear()
+    batch.clear()
+    return paper_count, chunk_count
 
 
 def load_index_state(cache_dir: Path) -> dict:
     state_file = cache_dir / "index_state.json"
     if state_file.exists():
-        with open(state_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(state_file.read_bytes())
     return {"indexed_files": {}}
 
 
-def save_index_state(cache_dir: Path, state: dict):
+def save_index_state(cache_dir: Path, state: dict, pretty: bool = False):
+    """原子写入索引状态（先写临时文件再替换，中途崩溃不会损坏旧文件）"""
     state_file = cache_dir / "index_state.json"
     state["last_indexed"] = datetime.now().isoformat()
-    with open(state_file, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    state["hash_algo"] = HASH_ALGO
+    state["version"] = STATE_VERSION
+    
+    tmp_file = state_file.with_suffix(".json.tmp")
+    tmp_file.write_bytes(orjson.dumps(state, option=orjson.OPT_INDENT_2 if pretty else 0))
+    tmp_file.replace(state_file)
+
 
+def build_embed_model(config: dict, embed_cache: Optional[EmbeddingCache] = None):
+    """索引用的嵌入模型（传入 embed_cache 时嵌入结果缓存到磁盘）
 
-def setup_llama_index(config: dict):
-    """配置 LlamaIndex"""
+    只在 index_papers 内部使用，不写入全局 Settings：Web UI 在同一进程内
+    重建索引后，查询仍使用自己的嵌入模型，而不是索引结束时已关闭缓存的这个。
+    """
     ollama_config = config["ollama"]
-    rag_config = config["rag"]
-    
-    Settings.llm = Ollama(
-        model=ollama_config["llm_model"],
-        base_url=ollama_config["base_url"],
-        request_timeout=120.0,
-    )
-    
-    Settings.embed_model = OllamaEmbedding(
+    embed_kwargs = dict(
         model_name=ollama_config["embed_model"],
         base_url=ollama_config["base_url"],
+        embed_batch_size=ollama_config.get("embed_batch_size", DEFAULT_EMBED_BATCH_SIZE),
     )
-    
-    Settings.node_parser = SentenceSplitter(
-        chunk_size=rag_config["chunk_size"],
-        chunk_overlap=rag_config["chunk_overlap"],
-    )
+    if embed_cache is not None:
+        return CachedOllamaEmbedding(cache=embed_cache, **embed_kwargs)
+    return PooledOllamaEmbedding(**embed_kwargs)
 
 
-def index_papers(config: dict, force: bool = False) -> int:
+def index_papers(config: dict, force: bool = False, pretty: bool = False) -> int:
     """索引 Zotero 文献"""
     cache_dir = Path(config["paths"]["cache_dir"])
     cache_dir.mkdir(parents=True, exist_ok=True)
@@ -244,7 +361,7 @@ def index_papers(config: dict, force: bool = False) -> int:
     if HAS_ZOTERO_META:
         try:
             console.print("[dim]正在提取 Zotero 元数据...[/dim]")
-            items = extract_and_cache_metadata(config, force=force)
+            items = extract_and_cache_metadata(config, force=force, pretty=pretty)
             if items:
                 attachment_map = build_attachment_mapping(items)
                 console.print(f"[green]已加载 {len(items)} 条元数据[/green]")
@@ -262,86 +379,163 @@ def index_papers(config: dict, force: bool = False) -> int:
     
     console.print(f"[green]找到 {len(papers)} 篇文献[/green]")
     
-    # 配置 LlamaIndex
-    setup_llama_index(config)
+    # 嵌入按内容缓存到磁盘，重建索引时未变化的块直接复用
+    embed_cache = EmbeddingCache(cache_dir / "embed_cache.sqlite")
+    embed_model = build_embed_model(config, embed_cache=embed_cache)
+    node_parser = SentenceSplitter(
+        chunk_size=config["rag"]["chunk_size"],
+        chunk_overlap=config["rag"]["chunk_overlap"],
+    )
     
     # 加载索引状态
     state = load_index_state(cache_dir) if not force else {"indexed_files": {}}
     
-    # 准备文档
-    all_documents = []
+    # 旧版本用 md5 记录的哈希无法比较，整体重建一次
+    if state["indexed_files"] and state.get("hash_algo") != HASH_ALGO:
+        console.print(f"[yellow]哈希算法已变更为 {HASH_ALGO}，将重新索引全部文献[/yellow]")
+        state = {"indexed_files": {}}
+    
+    # 旧格式按 zotero_key 记录，无法区分同一目录下的多个 PDF，整体重建一次
+    # （嵌入缓存仍然有效，未变化的块不会重新请求 Ollama）
+    if state["indexed_files"] and state.get("version", 1) != STATE_VERSION:
+        console.print("[yellow]索引状态格式已更新，将重新索引全部文献[/yellow]")
+        state = {"indexed_files": {}}
+    
+    # 向量表不存在（首次运行或从旧版存储升级）时需要全量索引
+    if state["indexed_files"] and not vector_store_exists(config):
+        console.print("[yellow]未找到 LanceDB 向量表，将重新索引全部文献[/yellow]")
+        state = {"indexed_files": {}}
+    
+    # 全量重建时清空向量表，避免追加出重复的块
+    if not state["indexed_files"]:
+        reset_vector_store(config)
+    
+    # 打开现有向量库，按论文增量更新
+    vector_store = get_vector_store(config)
+    index = VectorStoreIndex.from_vector_store(vector_store, embed_model=embed_model)
     indexed_count = 0
+    queued_count = 0
+    chunk_count = 0
+    
+    # 先比较 (size, mtime_ns)，只有可能变化的文件才交给子进程计算哈希
+    pending = []
+    known_hashes = []
+    signatures = []
+    for paper in papers:
+        entry = state["indexed_files"].get(paper.state_key)
+        try:
+            signature = get_file_signature(paper.file_path)
+        except OSError:
+            signature = None
+        
+        if entry and signature and (entry.get("size"), entry.get("mtime_ns")) == signature:
+            continue
+        
+        pending.append(paper)
+        known_hashes.append(entry.get("hash") if entry else None)
+        signatures.append(signature)
+    
+    # 节点攒够一个嵌入批次再写入，每次写入对应一次 /api/embed 请求
+    embed_batch_size = embed_model.embed_batch_size
+    batch_nodes = []
+    batch_papers = []
+    workers = os.cpu_count() or 1
     
-    with Progress(
+    with embed_cache, Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
         console=console,
-    ) as progress:
-        task = progress.add_task("索引文献...", total=len(papers))
+    ) as progress, ProcessPoolExecutor(
+        # 此时 LanceDB 与嵌入缓存的后台线程已启动，fork 可能在子进程中死锁
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        task = progress.add_task(
+            "索引文献...", total=len(papers), completed=len(papers) - len(pending)
+        )
         
-        for paper in papers:
-            file_hash = get_file_hash(paper.file_path)
+        results = _bounded_map(
+            executor, _extract_one, pending, known_hashes, max_pending=workers * 2
+        )
+        for (paper, pages, file_hash, error), signature in zip(results, signatures):
+            if error:
+                console.print(f"  [red]✗[/red] {paper.file_path.name}: {error}")
+                progress.advance(task)
+                continue
             
-            if not force and paper.zotero_key in state["indexed_files"]:
-                if state["indexed_files"][paper.zotero_key].get("hash") == file_hash:
-                    progress.advance(task)
-                    continue
+            # 内容未变化（仅 mtime 变化），更新签名即可
+            if pages is None:
+                if signature:
+                    entry = state["indexed_files"][paper.state_key]
+                    entry["size"], entry["mtime_ns"] = signature
+                progress.advance(task)
+                continue
             
-            progress.update(task, description=f"{paper.title[:40]}...")
+            documents = [
+                Document(
+                    text=text,
+                    metadata=meta,
+                    excluded_llm_metadata_keys=["file_path"],
+                    excluded_embed_metadata_keys=["file_path"],
+                )
+                for text, meta in pages
+            ]
             
             try:
-                pages = extract_pdf_by_pages(paper)
-                
-                for text, meta in pages:
-                    doc = Document(
-                        text=text,
-                        metadata=meta,
-                        excluded_llm_metadata_keys=["file_path"],
-                        excluded_embed_metadata_keys=["file_path"],
-                    )
-                    all_documents.append(doc)
-                
-                # 保存更丰富的状态
-                state["indexed_files"][paper.zotero_key] = {
-                    "hash": file_hash,
-                    "indexed_at": datetime.now().isoformat(),
-                    "title": paper.title,
-                    "authors": paper.authors,
-                    "year": paper.year,
-                    "pages": len(pages),
-                    "doi": paper.doi,
-                    "journal": paper.journal,
-                    "abstract": paper.abstract[:500] if paper.abstract else "",
-                    "tags": paper.tags,
-                }
-                indexed_count += 1
-                
-                # 显示更详细的信息
-                journal_info = f" [{paper.journal}]" if paper.journal else ""
-                console.print(f"  [green]✓[/green] {paper.authors} ({paper.year}) - {paper.title[:50]}{journal_info}")
-                
+                # 先删除该 PDF 旧的块，再写入新块，只有变化的文件需要重新嵌入
+                delete_paper_chunks(vector_store, paper.zotero_key, paper.file_path.name)
+                batch_nodes.extend(node_parser.get_nodes_from_documents(documents))
             except Exception as e:
                 console.print(f"  [red]✗[/red] {paper.file_path.name}: {e}")
+                progress.advance(task)
+                continue
+            
+            # 保存更丰富的状态（写入成功后才提交）
+            batch_papers.append((paper, {
+                "zotero_key": paper.zotero_key,
+                "hash": file_hash,
+                "size": signature[0] if signature else None,
+                "mtime_ns": signature[1] if signature else None,
+                "indexed_at": datetime.now().isoformat(),
+                "title": paper.title,
+                "authors": paper.authors,
+                "year": paper.year,
+                "pages": len(pages),
+                "doi": paper.doi,
+                "journal": paper.journal,
+                "abstract": paper.abstract[:500] if paper.abstract else "",
+                "tags": paper.tags,
+            }))
+            
+            # 成功信息只体现在进度条上，逐篇打印在大库上开销明显；失败仍逐条输出。
+            # indexed_count 要等整批写入后才更新，进度按已提交嵌入的论文计数
+            queued_count += 1
+            progress.update(
+                task, description=f"✓ {queued_count}/{len(pending)} {paper.title[:40]}..."
+            )
+            
+            if len(batch_nodes) >= embed_batch_size:
+                papers_done, chunks_done = _flush_batch(index, embed_model, batch_nodes, batch_papers, state)
+                indexed_count += papers_done
+                chunk_count += chunks_done
             
             progress.advance(task)
-    
-    # 构建索引
-    if all_documents:
-        console.print(f"\n[bold blue]构建向量索引 ({len(all_documents)} 个文档块)...[/bold blue]")
         
-        index = VectorStoreIndex.from_documents(
-            all_documents,
-            show_progress=True,
-        )
-        
-        # 持久化到本地
-        index.storage_context.persist(persist_dir=str(db_path))
+        papers_done, chunks_done = _flush_batch(index, embed_model, batch_nodes, batch_papers, state)
+        indexed_count += papers_done
+        chunk_count += chunks_done
+    
+    if chunk_count:
+        console.print(f"\n[bold green]向量索引已更新 ({chunk_count} 个文档块)[/bold green]")
         
-        console.print("[bold green]索引构建完成！[/bold green]")
+        # 写入按嵌入批次分成了许多小片段，结束时统一合并
+        optimize_vector_store(config)
+        index_type = build_ann_index(config, force=force)
+        if index_type:
+            console.print(f"[dim]已建立量化索引: {index_type}[/dim]")
     
-    save_index_state(cache_dir, state)
+    save_index_state(cache_dir, state, pretty=pretty)
     console.print(f"\n[bold green]完成！索引了 {indexed_count} 篇文献[/bold green]")
     
     return indexed_count
@@ -425,6 +619,7 @@ if __name__ == "__main__":
     parser.add_argument("--force", "-f", action="store_true", help="强制重新索引")
     parser.add_argument("--stats", "-s", action="store_true", help="显示统计")
     parser.add_argument("--list", "-l", action="store_true", help="列出已索引文献")
+    parser.add_argument("--pretty", action="store_true", help="以缩进格式写入 index_state.json 与 zotero_metadata.json（便于调试）")
     
     args = parser.parse_args()
     config = load_config(args.config)
@@ -452,4 +647,4 @@ if __name__ == "__main__":
     elif args.list:
         list_indexed_papers(config)
     else:
-        index_papers(config, force=args.force)
\ No newline at end of file
+        index_papers(config, force=args.force, pretty=args.pretty)
\ No newline at end of file
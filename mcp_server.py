@@ -5,7 +5,7 @@ Zotero MCP Server
 让 Claude Desktop 能够直接搜索和查询你的 Zotero 文献库。
 
 安装:
-    pip install mcp pydantic httpx
+    pip install mcp pydantic httpx orjson
 
 配置 Claude Desktop (claude_desktop_config.json):
     {
@@ -18,63 +18,73 @@ Zotero MCP Server
     }
 """
 
-import json
+import asyncio
 import re
+import heapq
 from pathlib import Path
 from typing import Optional, List
 from dataclasses import dataclass
 
+import orjson
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field, ConfigDict
 
-from llama_index.core import (
-    StorageContext,
-    Settings,
-    load_index_from_storage,
-)
+from llama_index.core import Settings
 from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.ollama import OllamaEmbedding
-import yaml
+from llama_index.core.vector_stores import (
+    MetadataFilter,
+    MetadataFilters,
+    FilterOperator,
+)
+
+from rag_utils import DEFAULT_EMBED_BATCH_SIZE, PooledOllama, PooledOllamaEmbedding, load_config, load_vector_index
 
 # ============================================================
-# 配置加载
+# 工具函数
 # ============================================================
 
-def load_config(config_path: str = None) -> dict:
-    """加载配置文件"""
-    if config_path is None:
-        # 尝试多个位置
-        candidates = [
-            Path(__file__).parent / "config.yaml",
-            Path.home() / "LocalKnowledge" / "config.yaml",
-            Path("config.yaml"),
-        ]
-        for p in candidates:
-            if p.exists():
-                config_path = str(p)
-                break
+def _dumps(obj) -> str:
+    """工具返回值序列化（orjson，输出 UTF-8 原文与 2 空格缩进，同 ensure_ascii=False, indent=2）"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+
+# index_state.json 缓存: path -> (mtime_ns, state)
+_state_cache: dict = {}
+
+
+def load_index_state(state_file: Path) -> Optional[dict]:
+    """读取索引状态，文件未修改时直接返回缓存；文件不存在返回 None
     
-    if config_path is None:
-        raise FileNotFoundError("找不到 config.yaml 配置文件")
+    每次调用只需一次 stat，命中缓存时跳过 JSON 解码。
+    """
+    try:
+        mtime_ns = state_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
     
-    with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    cached = _state_cache.get(state_file)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    
+    state = orjson.loads(state_file.read_bytes())
+    _state_cache[state_file] = (mtime_ns, state)
+    return state
 
 
 def setup_llama_index(config: dict):
     """配置 LlamaIndex"""
     ollama_config = config["ollama"]
     
-    Settings.llm = Ollama(
+    Settings.llm = PooledOllama(
         model=ollama_config["llm_model"],
         base_url=ollama_config["base_url"],
         request_timeout=120.0,
     )
     
-    Settings.embed_model = OllamaEmbedding(
+    Settings.embed_model = PooledOllamaEmbedding(
         model_name=ollama_config["embed_model"],
         base_url=ollama_config["base_url"],
+        embed_batch_size=ollama_config.get("embed_batch_size", DEFAULT_EMBED_BATCH_SIZE),
     )
 
 
@@ -82,7 +92,7 @@ def setup_llama_index(config: dict):
 # 数据类
 # ============================================================
 
-@dataclass
+@dataclass(slots=True)
 class Citation:
     """引用信息"""
     title: str
@@ -102,25 +112,22 @@ mcp = FastMCP("zotero_mcp")
 # 全局变量存储索引
 _index = None
 _config = None
+_index_lock = asyncio.Lock()
 
 
-def get_index():
-    """懒加载索引"""
+async def get_index():
+    """懒加载索引
+    
+    加载在线程中进行，不阻塞事件循环；加锁保证并发的首次调用只加载一次。
+    """
     global _index, _config
     
     if _index is None:
-        _config = load_config()
-        setup_llama_index(_config)
-        
-        db_path = Path(_config["paths"]["vector_db"])
-        if not db_path.exists():
-            raise FileNotFoundError(
-                f"向量数据库不存在: {db_path}\n"
-                "请先运行 python indexer.py 构建索引"
-            )
-        
-        storage_context = StorageContext.from_defaults(persist_dir=str(db_path))
-        _index = load_index_from_storage(storage_context)
+        async with _index_lock:
+            if _index is None:
+                _config = load_config()
+                await asyncio.to_thread(setup_llama_index, _config)
+                _index = await asyncio.to_thread(load_vector_index, _config)
     
     return _index, _config
 
@@ -201,21 +208,22 @@ async def zotero_search(params: SearchInput) -> str:
         JSON 格式的搜索结果，包含标题、作者、年份、页码和相关文本
     """
     try:
-        index, config = get_index()
+        index, config = await get_index()
         
         retriever = VectorIndexRetriever(
             index=index,
             similarity_top_k=params.top_k,
         )
         
-        nodes = retriever.retrieve(params.query)
+        # 嵌入请求与向量检索是同步阻塞的，放到线程中执行
+        nodes = await asyncio.to_thread(retriever.retrieve, params.query)
         
         if not nodes:
-            return json.dumps({
+            return _dumps({
                 "status": "no_results",
                 "message": "未找到相关文献",
                 "query": params.query
-            }, ensure_ascii=False, indent=2)
+            })
         
         results = []
         for node in nodes:
@@ -232,18 +240,18 @@ async def zotero_search(params: SearchInput) -> str:
                 "snippet": node.node.text[:500] + "..." if len(node.node.text) > 500 else node.node.text
             })
         
-        return json.dumps({
+        return _dumps({
             "status": "success",
             "query": params.query,
             "total_results": len(results),
             "results": results
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return _dumps({
             "status": "error",
             "message": str(e)
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 @mcp.tool(
@@ -271,23 +279,28 @@ async def zotero_list_papers(params: ListPapersInput) -> str:
     try:
         config = load_config()
         cache_dir = Path(config["paths"]["cache_dir"])
-        state_file = cache_dir / "index_state.json"
+        state = load_index_state(cache_dir / "index_state.json")
         
-        if not state_file.exists():
-            return json.dumps({
+        if state is None:
+            return _dumps({
                 "status": "error",
                 "message": "索引状态文件不存在，请先运行 indexer.py"
-            }, ensure_ascii=False, indent=2)
+            })
         
-        with open(state_file, "r", encoding="utf-8") as f:
-            state = json.load(f)
+        # 先筛选年份，再用堆只取前 limit 篇，不为整个文献库构造结果
+        candidates = (
+            (key, info) for key, info in state.get("indexed_files", {}).items()
+            if not params.year or info.get("year") == params.year
+        )
+        top = heapq.nlargest(
+            params.limit,
+            candidates,
+            key=lambda kv: (kv[1].get("year", ""), kv[1].get("title", "Unknown")),
+        )
         
         papers = []
-        for key, info in state.get("indexed_files", {}).items():
-            # 年份筛选
-            if params.year and info.get("year") != params.year:
-                continue
-            
+        for key, info in top:
+            abstract = info.get("abstract", "")
             papers.append({
                 "title": info.get("title", "Unknown"),
                 "authors": info.get("authors", "Unknown"),
@@ -295,17 +308,11 @@ async def zotero_list_papers(params: ListPapersInput) -> str:
                 "journal": info.get("journal", ""),
                 "doi": info.get("doi", ""),
                 "tags": info.get("tags", []),
-                "abstract": info.get("abstract", "")[:200] + "..." if len(info.get("abstract", "")) > 200 else info.get("abstract", ""),
+                "abstract": abstract[:200] + "..." if len(abstract) > 200 else abstract,
                 "pages": info.get("pages", 0),
-                "zotero_key": key
+                "zotero_key": info.get("zotero_key", key)
             })
         
-        # 按年份排序
-        papers.sort(key=lambda x: (x.get("year", "0000"), x.get("title", "")), reverse=True)
-        
-        # 限制数量
-        papers = papers[:params.limit]
-        
         # 统计
         years = {}
         journals = {}
@@ -316,7 +323,7 @@ async def zotero_list_papers(params: ListPapersInput) -> str:
             if j:
                 journals[j] = journals.get(j, 0) + 1
         
-        return json.dumps({
+        return _dumps({
             "status": "success",
             "total_in_library": len(state.get("indexed_files", {})),
             "returned": len(papers),
@@ -324,13 +331,13 @@ async def zotero_list_papers(params: ListPapersInput) -> str:
             "papers_by_year": dict(sorted(years.items(), reverse=True)),
             "top_journals": dict(sorted(journals.items(), key=lambda x: -x[1])[:5]),
             "papers": papers
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return _dumps({
             "status": "error",
             "message": str(e)
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 @mcp.tool(
@@ -355,15 +362,33 @@ async def zotero_get_paper_content(params: GetPaperInput) -> str:
         JSON 格式的论文内容
     """
     try:
-        index, config = get_index()
+        index, config = await get_index()
+        keyword = params.title_keyword.lower()
+        
+        # 先在索引状态中按标题匹配，命中时只在这些论文的块中检索
+        state = load_index_state(Path(config["paths"]["cache_dir"]) / "index_state.json")
+        matched_keys = []
+        if state is not None:
+            # 状态按单个 PDF 记录，同一条目的多个 PDF 只保留一个 zotero_key
+            matched_keys = list(dict.fromkeys(
+                info.get("zotero_key", key) for key, info in state.get("indexed_files", {}).items()
+                if keyword in info.get("title", "").lower()
+            ))
+        
+        filters = None
+        if matched_keys:
+            filters = MetadataFilters(filters=[
+                MetadataFilter(key="zotero_key", value=matched_keys, operator=FilterOperator.IN)
+            ])
         
         # 使用标题作为查询
         retriever = VectorIndexRetriever(
             index=index,
             similarity_top_k=10,
+            filters=filters,
         )
         
-        nodes = retriever.retrieve(params.title_keyword)
+        nodes = await asyncio.to_thread(retriever.retrieve, params.title_keyword)
         
         # 按论文分组
         papers = {}
@@ -372,7 +397,7 @@ async def zotero_get_paper_content(params: GetPaperInput) -> str:
             title = meta.get("title", "Unknown")
             
             # 检查标题是否匹配关键词
-            if params.title_keyword.lower() not in title.lower():
+            if keyword not in title.lower():
                 continue
             
             if title not in papers:
@@ -390,21 +415,21 @@ async def zotero_get_paper_content(params: GetPaperInput) -> str:
             })
         
         if not papers:
-            return json.dumps({
+            return _dumps({
                 "status": "not_found",
                 "message": f"未找到标题包含 '{params.title_keyword}' 的论文"
-            }, ensure_ascii=False, indent=2)
+            })
         
-        return json.dumps({
+        return _dumps({
             "status": "success",
             "papers": list(papers.values())
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return _dumps({
             "status": "error",
             "message": str(e)
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 @mcp.tool(
@@ -428,16 +453,13 @@ async def zotero_stats() -> str:
     try:
         config = load_config()
         cache_dir = Path(config["paths"]["cache_dir"])
-        state_file = cache_dir / "index_state.json"
+        state = load_index_state(cache_dir / "index_state.json")
         
-        if not state_file.exists():
-            return json.dumps({
+        if state is None:
+            return _dumps({
                 "status": "error",
                 "message": "索引未建立"
-            }, ensure_ascii=False, indent=2)
-        
-        with open(state_file, "r", encoding="utf-8") as f:
-            state = json.load(f)
+            })
         
         files = state.get("indexed_files", {})
         total_pages = sum(f.get("pages", 0) for f in files.values())
@@ -447,19 +469,19 @@ async def zotero_stats() -> str:
             y = f.get("year", "Unknown")
             years[y] = years.get(y, 0) + 1
         
-        return json.dumps({
+        return _dumps({
             "status": "success",
             "total_papers": len(files),
             "total_pages": total_pages,
             "last_indexed": state.get("last_indexed"),
             "papers_by_year": dict(sorted(years.items(), reverse=True))
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return _dumps({
             "status": "error",
             "message": str(e)
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 # ============================================================
@@ -3,33 +3,36 @@
 RAG 查询引擎 - 支持带引用来源的问答
 """
 
-from pathlib import Path
+import functools
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Optional
 
-import yaml
+import numpy as np
 from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
 
 from llama_index.core import (
-    VectorStoreIndex,
-    StorageContext,
     Settings,
-    load_index_from_storage,
     get_response_synthesizer,
 )
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor import SimilarityPostprocessor
 from llama_index.core.response_synthesizers import ResponseMode
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.ollama import OllamaEmbedding
+from llama_index.core.schema import QueryBundle
+
+from rag_utils import DEFAULT_EMBED_BATCH_SIZE, PooledOllama, PooledOllamaEmbedding, load_config, load_vector_index
 
 console = Console()
 
+# 引用条目模板：每条引用只做一次 % 格式化
+_REF_TPL = "%d. **%s**\n   %s%s — Page %s (relevance: %.2f)"
+_SNIPPET_TPL = "   > %s"
+
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Citation:
     """引用信息"""
     source: str
@@ -41,48 +44,193 @@ class Citation:
     score: float
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RAGResponse:
-    """RAG 响应"""
+    """RAG 响应（不可变，可哈希）"""
     answer: str
-    citations: list[Citation]
+    citations: tuple[Citation, ...]
     
     def format_markdown(self) -> str:
-        lines = [self.answer, "", "---", "", "**References:**", ""]
-        
-        for i, cite in enumerate(self.citations, 1):
-            year_str = f" ({cite.year})" if cite.year else ""
-            lines.append(
-                f"{i}. **{cite.title}**\n"
-                f"   {cite.authors}{year_str} — Page {cite.page} (relevance: {cite.score:.2f})"
-            )
-            snippet = cite.text_snippet[:200] + "..." if len(cite.text_snippet) > 200 else cite.text_snippet
-            lines.append(f"   > {snippet}")
-            lines.append("")
-        
-        return "\n".join(lines)
+        return _format_markdown(self)
 
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+@functools.lru_cache(maxsize=128)
+def _format_markdown(response: RAGResponse) -> str:
+    """RAGResponse -> Markdown（与 web_ui.format_response 一样在模块级按响应缓存）"""
+    # 头部 6 行 + 每条引用 3 行，预先分配好列表
+    lines = [None] * (6 + 3 * len(response.citations))
+    lines[:6] = response.answer, "", "---", "", "**References:**", ""
+    
+    pos = 6
+    for i, cite in enumerate(response.citations, 1):
+        year_str = " (%s)" % cite.year if cite.year else ""
+        lines[pos] = _REF_TPL % (i, cite.title, cite.authors, year_str, cite.page, cite.score)
+        # 只切一次：多取 1 个字符即可判断是否超长
+        snippet = cite.text_snippet[:201]
+        if len(snippet) == 201:
+            snippet = snippet[:200] + "..."
+        lines[pos + 1] = _SNIPPET_TPL % snippet
+        lines[pos + 2] = ""
+        pos += 3
+    
+    return "\n".join(lines)
+
+
+def _node_to_citation(node) -> Citation:
+    """检索结果节点 -> Citation（按字段顺序位置传参）"""
+    get = node.node.metadata.get
+    return Citation(
+        get("source", "Unknown"),
+        get("page", 0),
+        get("title", "Unknown"),
+        get("authors", "Unknown"),
+        get("year", ""),
+        node.node.text,
+        node.score or 0.0,
+    )
+
+
+class NumpyPostprocessor(SimilarityPostprocessor):
+    """SimilarityPostprocessor 的向量化版本：一次比较得到保留掩码
+    
+    与父类行为一致：未设置阈值时全部保留，score 为 None 的节点被丢弃（记为 NaN）。
+    """
+    
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if self.similarity_cutoff is None or not nodes:
+            return list(nodes)
+        
+        scores = np.fromiter(
+            (np.nan if n.score is None else n.score for n in nodes),
+            dtype=np.float64,  # 与父类的 Python float 比较结果完全一致
+            count=len(nodes),
+        )
+        mask = scores >= self.similarity_cutoff
+        return [n for n, keep in zip(nodes, mask.tolist()) if keep]
 
 
 def setup_llama_index(config: dict):
     ollama_config = config["ollama"]
     
-    Settings.llm = Ollama(
+    Settings.llm = PooledOllama(
         model=ollama_config["llm_model"],
         base_url=ollama_config["base_url"],
         request_timeout=120.0,
     )
     
-    Settings.embed_model = OllamaEmbedding(
+    Settings.embed_model = PooledOllamaEmbedding(
         model_name=ollama_config["embed_model"],
         base_url=ollama_config["base_url"],
+        embed_batch_size=ollama_config.get("embed_batch_size", DEFAULT_EMBED_BATCH_SIZE),
     )
 
 
+class AnswerCache:
+    """问题 -> 回答的 LRU 缓存
+    
+    先按规范化后的问题文本精确匹配；未命中时可用问题嵌入做语义匹配，
+    与已缓存问题的余弦相似度不低于 threshold 即复用该回答
+    （threshold 为 None 时关闭语义匹配，默认关闭）。
+    
+    注意：只差一个年份或实体的问题（“2020 年…” / “2021 年…”、
+    “X 与 Y 的区别” / “X 与 Z 的区别”）余弦相似度常在 0.95 以上，
+    开启后可能返回另一个问题的回答。
+    
+    传入 state_file（index_state.json）时，每次访问先比较其 mtime，
+    索引在其他进程中更新后自动清空。Gradio 工作线程、asyncio.to_thread
+    会并发访问，所有操作都在锁内进行。
+    """
+    
+    def __init__(self, maxsize: int = 256, threshold: Optional[float] = None,
+                 state_file: Optional[Path] = None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.state_file = state_file
+        self._state_mtime = self._read_state_mtime()
+        self._lock = threading.Lock()
+        # key -> (单位化的问题嵌入, 回答)
+        self._entries: OrderedDict[str, tuple[Optional[np.ndarray], RAGResponse]] = OrderedDict()
+        # 已缓存问题嵌入堆叠成的矩阵（行与 _matrix_keys 对应），写入后惰性重建
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: list[str] = []
+    
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(question.split()).lower()
+    
+    def _read_state_mtime(self) -> Optional[int]:
+        if self.state_file is None:
+            return None
+        try:
+            return self.state_file.stat().st_mtime_ns
+        except OSError:
+            return None
+    
+    def _check_state(self):
+        """索引状态文件变化时丢弃全部回答（需持有锁）"""
+        mtime = self._read_state_mtime()
+        if mtime != self._state_mtime:
+            self._state_mtime = mtime
+            self._clear()
+    
+    def get(self, key: str) -> Optional[RAGResponse]:
+        with self._lock:
+            self._check_state()
+            return self._get(key)
+    
+    def _get(self, key: str) -> Optional[RAGResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+    
+    def get_similar(self, embedding: list[float]) -> Optional[RAGResponse]:
+        if self.threshold is None:
+            return None
+        
+        query = _unit(embedding)
+        with self._lock:
+            self._check_state()
+            if self._matrix is None:
+                self._matrix_keys = [k for k, (cached, _) in self._entries.items() if cached is not None]
+                if not self._matrix_keys:
+                    return None
+                self._matrix = np.stack([self._entries[k][0] for k in self._matrix_keys])
+            
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self._get(self._matrix_keys[best])
+    
+    def put(self, key: str, embedding: Optional[list[float]], response: RAGResponse):
+        unit = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._check_state()
+            self._entries[key] = (unit, response)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._matrix = None
+    
+    def clear(self):
+        with self._lock:
+            self._state_mtime = self._read_state_mtime()
+            self._clear()
+    
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._matrix_keys = []
+
+
+def _unit(vector: list[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
 class ZoteroRAG:
     """Zotero 文献 RAG 引擎"""
     
@@ -92,32 +240,58 @@ class ZoteroRAG:
         
         setup_llama_index(config)
         self.index = self._load_index()
-        self.query_engine = self._create_query_engine()
+        self._retrievers: dict[int, VectorIndexRetriever] = {}
+        self._main_retriever = self._get_retriever(self.rag_config["top_k"])
+        self.query_engine = self._create_query_engine(self._main_retriever)
+        self.streaming_engine = self._create_query_engine(self._main_retriever, streaming=True)
+        self.answer_cache = AnswerCache(
+            threshold=self.rag_config.get("semantic_cache_threshold"),
+            state_file=Path(config["paths"]["cache_dir"]) / "index_state.json",
+        )
     
     def _load_index(self):
-        db_path = Path(self.config["paths"]["vector_db"])
-        
-        if not db_path.exists():
-            raise FileNotFoundError(
-                f"向量数据库不存在: {db_path}\n"
-                "请先运行 python indexer.py 构建索引"
-            )
+        return load_vector_index(self.config)
+    
+    def reload_index(self):
+        """重新打开向量库，替换索引、检索器缓存与查询引擎
         
-        storage_context = StorageContext.from_defaults(persist_dir=str(db_path))
-        return load_index_from_storage(storage_context)
+        索引器只增量更新变化的论文，更新后调用即可看到新数据；
+        LLM / 嵌入配置保持不变。新引擎构建完成后才替换，
+        进行中的查询继续使用旧引擎。
+        """
+        index = self._load_index()
+        top_k = self.rag_config["top_k"]
+        main_retriever = VectorIndexRetriever(index=index, similarity_top_k=top_k)
+        query_engine = self._create_query_engine(main_retriever)
+        streaming_engine = self._create_query_engine(main_retriever, streaming=True)
+        self.index, self._retrievers = index, {top_k: main_retriever}
+        self._main_retriever = main_retriever
+        self.query_engine, self.streaming_engine = query_engine, streaming_engine
+        # 索引内容已变化，旧回答可能过时
+        self.answer_cache.clear()
     
-    def _create_query_engine(self):
-        retriever = VectorIndexRetriever(
-            index=self.index,
-            similarity_top_k=self.rag_config["top_k"],
-        )
+    def _get_retriever(self, top_k: int) -> VectorIndexRetriever:
+        """按 top_k 复用检索器，避免每次检索都重新构造
         
-        postprocessor = SimilarityPostprocessor(
+        top_k 与配置一致时返回查询引擎所用的同一个检索器。
+        """
+        retriever = self._retrievers.get(top_k)
+        if retriever is None:
+            retriever = VectorIndexRetriever(
+                index=self.index,
+                similarity_top_k=top_k,
+            )
+            self._retrievers[top_k] = retriever
+        return retriever
+    
+    def _create_query_engine(self, retriever: VectorIndexRetriever, streaming: bool = False):
+        postprocessor = NumpyPostprocessor(
             similarity_cutoff=self.rag_config["similarity_threshold"]
         )
         
         response_synthesizer = get_response_synthesizer(
             response_mode=ResponseMode.COMPACT,
+            streaming=streaming,
         )
         
         return RetrieverQueryEngine(
@@ -126,49 +300,79 @@ class ZoteroRAG:
             response_synthesizer=response_synthesizer,
         )
     
+    @staticmethod
+    def _build_citations(nodes) -> list[Citation]:
+        return [_node_to_citation(node) for node in nodes]
+    
+    def _query_bundle(self, question: str, embedding: Optional[list[float]]):
+        # 已为语义缓存计算过嵌入时直接交给检索器，避免重复请求 Ollama
+        return QueryBundle(question, embedding=embedding) if embedding is not None else question
+    
     def query(self, question: str) -> RAGResponse:
-        response = self.query_engine.query(question)
+        key = AnswerCache.normalize(question)
+        if (cached := self.answer_cache.get(key)) is not None:
+            return cached
         
-        citations = []
-        for node in response.source_nodes:
-            meta = node.node.metadata
-            citations.append(Citation(
-                source=meta.get("source", "Unknown"),
-                page=meta.get("page", 0),
-                title=meta.get("title", "Unknown"),
-                authors=meta.get("authors", "Unknown"),
-                year=meta.get("year", ""),
-                text_snippet=node.node.text,
-                score=node.score if node.score else 0.0,
-            ))
+        embedding = None
+        if self.answer_cache.threshold is not None:
+            embedding = Settings.embed_model.get_query_embedding(question)
+            if (cached := self.answer_cache.get_similar(embedding)) is not None:
+                return cached
         
-        return RAGResponse(answer=str(response), citations=citations)
+        response = self.query_engine.query(self._query_bundle(question, embedding))
+        result = RAGResponse(answer=str(response), citations=tuple(self._build_citations(response.source_nodes)))
+        self.answer_cache.put(key, embedding, result)
+        return result
     
-    def retrieve_only(self, question: str, top_k: int = 5) -> list[Citation]:
-        retriever = VectorIndexRetriever(
-            index=self.index,
-            similarity_top_k=top_k,
-        )
+    async def astream_query(self, question: str) -> AsyncIterator[RAGResponse]:
+        """流式查询：每生成一段文本产出一次当前的部分回答（不含引用），
+        最后产出带引用的完整 RAGResponse；命中回答缓存时直接产出缓存结果"""
+        key = AnswerCache.normalize(question)
+        if (cached := self.answer_cache.get(key)) is not None:
+            yield cached
+            return
         
-        nodes = retriever.retrieve(question)
+        embedding = None
+        if self.answer_cache.threshold is not None:
+            embedding = await Settings.embed_model.aget_query_embedding(question)
+            if (cached := self.answer_cache.get_similar(embedding)) is not None:
+                yield cached
+                return
+        
+        response = await self.streaming_engine.aquery(self._query_bundle(question, embedding))
         
-        citations = []
-        for node in nodes:
-            meta = node.node.metadata
-            citations.append(Citation(
-                source=meta.get("source", "Unknown"),
-                page=meta.get("page", 0),
-                title=meta.get("title", "Unknown"),
-                authors=meta.get("authors", "Unknown"),
-                year=meta.get("year", ""),
-                text_snippet=node.node.text,
-                score=node.score if node.score else 0.0,
-            ))
+        parts = []
+        async for token in response.async_response_gen():
+            parts.append(token)
+            yield RAGResponse(answer="".join(parts), citations=())
         
-        return citations
+        result = RAGResponse(answer="".join(parts), citations=tuple(self._build_citations(response.source_nodes)))
+        self.answer_cache.put(key, embedding, result)
+        yield result
+    
+    def retrieve_only(self, question: str, top_k: int = 5) -> list[Citation]:
+        retriever = self._get_retriever(top_k)
+        nodes = retriever.retrieve(question)
+        return self._build_citations(nodes)
+    
+    async def aretrieve_only(self, question: str, top_k: int = 5) -> list[Citation]:
+        retriever = self._get_retriever(top_k)
+        nodes = await retriever.aretrieve(question)
+        return self._build_citations(nodes)
+
+
+def _truncate(text: str, width: int) -> str:
+    """超过 width 个字符时截断并加省略号（只切片一次）"""
+    head = text[:width + 1]
+    return head[:width] + "..." if len(head) > width else head
 
 
 def print_response(response: RAGResponse):
+    # 终端渲染组件只在命令行模式用到，Web UI / MCP 导入本模块时不加载
+    from rich.markdown import Markdown
+    from rich.panel import Panel
+    from rich.table import Table
+    
     console.print(Panel(
         Markdown(response.answer),
         title="[bold green]Answer[/bold green]",
@@ -184,20 +388,27 @@ def print_response(response: RAGResponse):
         table.add_column("Page", justify="right")
         table.add_column("Score", justify="right")
         
-        for i, cite in enumerate(response.citations, 1):
-            table.add_row(
+        rows = [
+            (
                 str(i),
-                cite.title[:40] + "..." if len(cite.title) > 40 else cite.title,
-                cite.authors[:20] + "..." if len(cite.authors) > 20 else cite.authors,
+                _truncate(cite.title, 40),
+                _truncate(cite.authors, 20),
                 cite.year or "-",
                 str(cite.page),
                 f"{cite.score:.2f}",
             )
+            for i, cite in enumerate(response.citations, 1)
+        ]
+        for row in rows:
+            table.add_row(*row)
         
         console.print(table)
 
 
 def interactive_mode(rag: ZoteroRAG):
+    from rich.panel import Panel
+    from rich.table import Table
+    
     console.print(Panel(
         "[bold]Zotero RAG 交互模式[/bold]\n\n"
         "输入问题进行查询，输入 'quit' 或 'exit' 退出\n"
@@ -228,13 +439,12 @@ def interactive_mode(rag: ZoteroRAG):
                     table.add_column("Page")
                     table.add_column("Score")
                     
-                    for cite in citations:
-                        table.add_row(
-                            cite.title[:50],
-                            cite.authors[:20],
-                            str(cite.page),
-                            f"{cite.score:.2f}"
-                        )
+                    rows = [
+                        (cite.title[:50], cite.authors[:20], str(cite.page), f"{cite.score:.2f}")
+                        for cite in citations
+                    ]
+                    for row in rows:
+                        table.add_row(*row)
                     
                     console.print(table)
                 else:
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+RAG 公共组件
+
+indexer / query / mcp_server 共用的配置加载、Ollama 嵌入封装、嵌入缓存与 LanceDB 向量库访问。
+"""
+
+import copy
+import functools
+import math
+import os
+import queue
+import sqlite3
+import threading
+from array import array
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import lancedb
+import ollama
+import xxhash
+import yaml
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.ollama import OllamaEmbedding
+from llama_index.llms.ollama import Ollama
+from llama_index.vector_stores.lancedb import LanceDBVectorStore
+
+# 未指定配置路径时依次查找的位置（MCP Server 由客户端启动，工作目录不确定）
+CONFIG_CANDIDATES = (
+    Path(__file__).parent / "config.yaml",
+    Path.home() / "LocalKnowledge" / "config.yaml",
+    Path("config.yaml"),
+)
+
+# 有 libyaml 时使用 C 实现的解析器
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# 默认批大小：CPU/MPS 32，CUDA 可在 config.yaml 中调到 128
+DEFAULT_EMBED_BATCH_SIZE = 32
+
+# LanceDB 表名
+VECTOR_TABLE = "zotero"
+
+# rag.quantization -> LanceDB 索引类型（pq: 乘积量化，sq: int8 标量量化）
+QUANTIZATION_INDEX_TYPES = {
+    "pq": "IVF_PQ",
+    "sq": "IVF_HNSW_SQ",
+}
+
+# 行数较少时暴力检索已经足够快，且 IVF/PQ 训练需要足够样本
+MIN_ROWS_FOR_ANN_INDEX = 10000
+
+# optimize 时保留的旧表版本时长
+VERSION_RETENTION = timedelta(hours=1)
+
+
+# 单次嵌入请求（一个批次）的超时秒数
+EMBED_REQUEST_TIMEOUT = 300.0
+
+# 嵌入与 LLM 请求共用的连接池上限
+HTTP_POOL_LIMITS = httpx.Limits(
+    max_keepalive_connections=40,
+    max_connections=100,
+    keepalive_expiry=30.0,
+)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_config(config_path: str, mtime_ns: int) -> dict:
+    with open(config_path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_YAML_LOADER)
+
+
+def load_config(config_path: Optional[str] = None) -> dict:
+    """加载配置（indexer / query / web_ui / mcp_server / zotero_meta 共用）
+
+    未指定路径时按 CONFIG_CANDIDATES 查找。解析结果按 (路径, mtime) 缓存，
+    修改 config.yaml 后自动重新解析；返回的是副本，调用方可以随意修改。
+    """
+    if config_path is None:
+        found = next((p for p in CONFIG_CANDIDATES if p.exists()), None)
+        if found is None:
+            raise FileNotFoundError("找不到 config.yaml 配置文件")
+        config_path = str(found)
+    return copy.deepcopy(_parse_config(config_path, os.stat(config_path).st_mtime_ns))
+
+
+@functools.lru_cache(maxsize=4)
+def get_ollama_client(base_url: str, timeout: float) -> ollama.Client:
+    """按 (地址, 超时) 共享的 ollama.Client，底层 httpx 连接池保持 keep-alive"""
+    return ollama.Client(host=base_url, timeout=timeout, limits=HTTP_POOL_LIMITS)
+
+
+class PooledOllama(Ollama):
+    """同步调用复用共享 ollama.Client 的 Ollama LLM
+
+    多个 Ollama 实例（重建引擎、Web UI 重新加载）共享同一个连接池，
+    不会各自重新建立连接。异步客户端与事件循环绑定，仍由 LlamaIndex 管理。
+    """
+
+    @property
+    def client(self) -> ollama.Client:
+        return get_ollama_client(self.base_url, self.request_timeout)
+
+
+class PooledOllamaEmbedding(OllamaEmbedding):
+    """同步请求复用共享 ollama.Client 的 OllamaEmbedding
+
+    批量嵌入、keep_alive、ollama_additional_kwargs 与 query/text instruction
+    均由 OllamaEmbedding 自身处理；这里只把同步客户端换成与 PooledOllama
+    共用的连接池。异步客户端与事件循环绑定，仍由 LlamaIndex 管理。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client = get_ollama_client(self.base_url, EMBED_REQUEST_TIMEOUT)
+
+
+class EmbeddingCache:
+    """磁盘嵌入缓存：xxh64(模型名 + 文本) -> float32 向量
+
+    存储在 SQLite 中。读取在调用线程进行，写入交给后台线程批量提交，
+    不阻塞索引流程。连接与写线程均在首次使用时才创建。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return xxhash.xxh64_hexdigest(f"{model_name}\0{text}".encode())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        return conn
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if self._conn is None:
+            self._conn = self._connect()
+
+        found = {}
+        # SQLite 单条语句的参数个数有限，分块查询
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        self._queue.put(items)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while (items := self._queue.get()) is not None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            conn.commit()
+        conn.close()
+
+    def close(self):
+        """等待后台写入完成并关闭连接"""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CachedOllamaEmbedding(PooledOllamaEmbedding):
+    """带磁盘缓存的 PooledOllamaEmbedding
+
+    只为缓存未命中的文本请求 Ollama，强制重建索引时未变化的块无需重新嵌入。
+    """
+
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, cache: EmbeddingCache, **kwargs):
+        super().__init__(**kwargs)
+        self._cache = cache
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        embeddings = self._cache.get_many(keys)
+
+        misses = [i for i, key in enumerate(keys) if key not in embeddings]
+        if misses:
+            computed = super()._get_text_embeddings([texts[i] for i in misses])
+            new_items = {keys[i]: vector for i, vector in zip(misses, computed)}
+            embeddings.update(new_items)
+            self._cache.put_many(new_items)
+
+        return [embeddings[key] for key in keys]
+
+
+class ZoteroVectorStore(LanceDBVectorStore):
+    """按本项目的写入与打分方式调整的 LanceDBVectorStore
+
+    - 表不存在时先以 overwrite 模式建表，之后的每批写入都追加：
+      LanceDBVectorStore 每批写入都会调用一次 add，append 模式在表不存在时
+      无法建表（TableNotFoundError），overwrite 模式下又只会保留最后一批。
+    - 检索得分换算回余弦相似度：LlamaIndex 给出的是 exp(-d)，d 为平方 L2
+      距离；Ollama 返回单位向量，cos = 1 - d / 2。similarity_threshold 与
+      界面上显示的 relevance 因此仍是余弦相似度。
+    """
+
+    def add(self, nodes, **add_kwargs):
+        ids = super().add(nodes, **add_kwargs)
+        if self._table is not None:
+            self.mode = "append"
+        return ids
+
+    def query(self, query, **kwargs):
+        # 基类的 aquery 直接调用 query，异步检索同样经过换算
+        return _to_cosine(super().query(query, **kwargs))
+
+
+def _to_cosine(result):
+    """exp(-d) -> 1 - d / 2（d 为平方 L2 距离）"""
+    if result.similarities:
+        result.similarities = [
+            1.0 + math.log(s) / 2 if s > 0 else -1.0 for s in result.similarities
+        ]
+    return result
+
+
+def get_vector_store(config: dict) -> LanceDBVectorStore:
+    """打开 LanceDB 向量库
+
+    首次运行或 --force 删表后以 overwrite 模式建表，已有表则直接追加。
+
+    nprobes / refine_factor 只在建有量化索引时生效：检索时扫描的 IVF
+    分区数，以及取 top_k × refine_factor 个候选再用原始 float32 向量重排
+    （补偿量化误差）。
+    """
+    db_path = Path(config["paths"]["vector_db"])
+    rag_config = config["rag"]
+    table_exists = VECTOR_TABLE in lancedb.connect(str(db_path)).table_names()
+    return ZoteroVectorStore(
+        uri=str(db_path),
+        table_name=VECTOR_TABLE,
+        mode="append" if table_exists else "overwrite",
+        nprobes=rag_config.get("nprobes", 20),
+        refine_factor=rag_config.get("refine_factor"),
+    )
+
+
+def reset_vector_store(config: dict):
+    """删除向量表（强制重建索引时使用）"""
+    db = lancedb.connect(str(Path(config["paths"]["vector_db"])))
+    if VECTOR_TABLE in db.table_names():
+        db.drop_table(VECTOR_TABLE)
+
+
+def delete_paper_chunks(vector_store: LanceDBVectorStore, zotero_key: str, source: str):
+    """删除某个 PDF 已写入的全部块
+
+    同一 zotero_key 下可能有多个 PDF，按 (zotero_key, 文件名) 定位，
+    只删除发生变化的那一个。
+    """
+    db = lancedb.connect(vector_store.uri)
+    if VECTOR_TABLE not in db.table_names():
+        return
+    # zotero_key 为 8 位大写字母数字，可直接拼入过滤表达式；文件名中的单引号需转义
+    source = source.replace("'", "''")
+    db.open_table(VECTOR_TABLE).delete(
+        f"metadata.zotero_key = '{zotero_key}' AND metadata.source = '{source}'"
+    )
+
+
+def optimize_vector_store(config: dict):
+    """合并小片段、把新数据并入已有索引，并清理旧版本
+
+    每个嵌入批次都是一次独立的追加，全量构建会留下数百个片段与表版本，
+    拖慢扫描与 ANN 检索并占用磁盘。旧版本保留 VERSION_RETENTION，
+    其他进程（MCP Server）已打开的表句柄在重新加载前仍可读取。
+    """
+    db = lancedb.connect(str(Path(config["paths"]["vector_db"])))
+    if VECTOR_TABLE in db.table_names():
+        db.open_table(VECTOR_TABLE).optimize(cleanup_older_than=VERSION_RETENTION)
+
+
+def build_ann_index(config: dict, force: bool = False) -> Optional[str]:
+    """按 rag.quantization 为向量表建立量化 ANN 索引，返回新建的索引类型
+
+    未开启量化或行数不足时不建索引，返回 None。LlamaIndex 的 LanceDB
+    检索使用默认的 L2 距离，索引采用同一度量（Ollama 返回的向量已归一化，
+    L2 与余弦的排序一致）。
+
+    已有同类型索引且未指定 force 时不重新训练（大表上要几分钟），
+    返回 None（新写入的片段由 optimize_vector_store 增量并入现有索引）。
+    """
+    quantization = config["rag"].get("quantization", "none")
+    index_type = QUANTIZATION_INDEX_TYPES.get(quantization)
+    if index_type is None:
+        return None
+
+    db = lancedb.connect(str(Path(config["paths"]["vector_db"])))
+    if VECTOR_TABLE not in db.table_names():
+        return None
+
+    table = db.open_table(VECTOR_TABLE)
+    if table.count_rows() < MIN_ROWS_FOR_ANN_INDEX:
+        return None
+
+    # list_indices 给出的类型名形如 IvfPq，与 IVF_PQ 去掉下划线后忽略大小写比较
+    wanted = index_type.replace("_", "").lower()
+    if not force and any(
+        idx.index_type.replace("_", "").lower() == wanted for idx in table.list_indices()
+    ):
+        return None
+
+    table.create_index(
+        metric="L2",
+        num_partitions=256,
+        num_sub_vectors=16,
+        index_type=index_type,
+        replace=True,
+    )
+    return index_type
+
+
+def vector_store_exists(config: dict) -> bool:
+    db_path = Path(config["paths"]["vector_db"])
+    return (db_path / f"{VECTOR_TABLE}.lance").exists()
+
+
+def load_vector_index(config: dict) -> VectorStoreIndex:
+    """从 LanceDB 加载索引
+
+    只打开表句柄，不把文档块或向量读入内存：Lance 文件按需读取，
+    检索时才载入命中的数据页，启动耗时与库大小无关。
+    """
+    db_path = Path(config["paths"]["vector_db"])
+    if not vector_store_exists(config):
+        raise FileNotFoundError(
+            f"向量数据库不存在: {db_path}\n"
+            "请先运行 python indexer.py 构建索引"
+        )
+
+    return VectorStoreIndex.from_vector_store(get_vector_store(config))
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 项目为平铺脚本，测试时把仓库根目录加入导入路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
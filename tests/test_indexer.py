@@ -0,0 +1,99 @@
+"""indexer 增量索引测试（不依赖 Ollama：嵌入模型换成 LlamaIndex 的 MockEmbedding）"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+lancedb = pytest.importorskip("lancedb")
+pytest.importorskip("llama_index.vector_stores.lancedb")
+
+from llama_index.core import MockEmbedding
+
+import indexer
+from rag_utils import VECTOR_TABLE
+
+ZOTERO_KEY = "ABCD1234"
+
+
+def _write_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+
+
+def _mock_embed_model(config, embed_cache=None):
+    return MockEmbedding(embed_dim=8)
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexer, "HAS_ZOTERO_META", False)
+    monkeypatch.setattr(indexer, "build_embed_model", _mock_embed_model)
+    (tmp_path / "storage" / ZOTERO_KEY).mkdir(parents=True)
+    return {
+        "zotero": {"storage_dir": str(tmp_path / "storage")},
+        "paths": {
+            "cache_dir": str(tmp_path / "cache"),
+            "vector_db": str(tmp_path / "lancedb"),
+        },
+        "rag": {"chunk_size": 512, "chunk_overlap": 0, "quantization": "none"},
+    }
+
+
+def _indexed_texts(config):
+    table = lancedb.connect(config["paths"]["vector_db"]).open_table(VECTOR_TABLE)
+    return [row["text"] for row in table.to_arrow().to_pylist()]
+
+
+def test_reindex_modified_paper_replaces_old_chunks(config):
+    pdf = Path(config["zotero"]["storage_dir"]) / ZOTERO_KEY / "Doe - 2020 - Sample Paper.pdf"
+    original = "original version of the sample paper body text " * 3
+    _write_pdf(pdf, [original, original])
+
+    assert indexer.index_papers(config) == 1
+    texts = _indexed_texts(config)
+    assert len(texts) == 2
+    assert all("original" in t for t in texts)
+
+    revised = "revised version of the sample paper body text " * 3
+    _write_pdf(pdf, [revised])
+    st = pdf.stat()
+    os.utime(pdf, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    assert indexer.index_papers(config) == 1
+    texts = _indexed_texts(config)
+    assert len(texts) == 1
+    assert "revised" in texts[0]
+
+
+def test_unchanged_paper_is_skipped(config):
+    pdf = Path(config["zotero"]["storage_dir"]) / ZOTERO_KEY / "Doe - 2020 - Sample Paper.pdf"
+    _write_pdf(pdf, ["unchanged sample paper body text " * 3])
+
+    assert indexer.index_papers(config) == 1
+    assert indexer.index_papers(config) == 0
+    assert len(_indexed_texts(config)) == 1
+
+
+def test_reindex_one_of_several_pdfs_keeps_the_others(config):
+    storage = Path(config["zotero"]["storage_dir"]) / ZOTERO_KEY
+    main = storage / "Doe - 2020 - Sample Paper.pdf"
+    supplement = storage / "Doe - 2020 - Sample Paper Supplement.pdf"
+    _write_pdf(main, ["main article body text of the sample paper " * 3])
+    _write_pdf(supplement, ["supplementary material for the sample paper " * 3])
+
+    assert indexer.index_papers(config) == 2
+
+    _write_pdf(main, ["revised article body text of the sample paper " * 3])
+    st = main.stat()
+    os.utime(main, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    assert indexer.index_papers(config) == 1
+    texts = _indexed_texts(config)
+    assert len(texts) == 2
+    assert any("revised" in t for t in texts)
+    assert any("supplementary" in t for t in texts)
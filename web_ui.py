@@ -3,88 +3,109 @@
 Gradio Web 界面 - 适配 Gradio 6.0
 """
 
+import asyncio
+import functools
+import threading
 import gradio as gr
 from pathlib import Path
 
-import yaml
 from query import ZoteroRAG, RAGResponse
+from rag_utils import load_config
 from indexer import get_index_stats, index_papers
 
 # 全局变量
 rag_engine = None
-config = None
+_rag_lock = threading.Lock()
 
+# 引用条目模板：每条引用只做一次 % 格式化
+_REF_TPL = "**[%d]** %s\n- Authors: %s%s\n- Page: %s | Relevance: %.0f%%\n"
+_SNIPPET_TPL = "> %s\n\n"
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
 
-
-def init_rag():
-    global rag_engine, config
-    
-    if config is None:
-        config = load_config()
+def _ensure_rag(config: dict) -> ZoteroRAG:
+    """加锁创建 rag_engine，并发点击时只加载一次索引"""
+    global rag_engine
     
+    if rag_engine is None:
+        with _rag_lock:
+            if rag_engine is None:
+                rag_engine = ZoteroRAG(config)
+    return rag_engine
+
+
+def _refresh_rag(config: dict):
+    """索引更新后刷新引擎：已加载则原地重新打开向量库"""
+    with _rag_lock:
+        if rag_engine is not None:
+            rag_engine.reload_index()
+            return
+    _ensure_rag(config)
+
+
+async def init_rag():
     try:
-        rag_engine = ZoteroRAG(config)
+        await asyncio.to_thread(_ensure_rag, load_config())
         return "✅ RAG 引擎加载成功"
     except Exception as e:
         return f"❌ 加载失败: {e}"
 
 
+@functools.lru_cache(maxsize=128)
 def format_response(response: RAGResponse) -> str:
     answer = response.answer
     
     if response.citations:
-        refs = ["\n\n---\n\n### 📚 References\n"]
+        refs = [None] * (1 + 2 * len(response.citations))
+        refs[0] = "\n\n---\n\n### 📚 References\n"
+        
+        pos = 1
         for i, cite in enumerate(response.citations, 1):
-            year_str = f" ({cite.year})" if cite.year else ""
-            refs.append(
-                f"**[{i}]** {cite.title}\n"
-                f"- Authors: {cite.authors}{year_str}\n"
-                f"- Page: {cite.page} | Relevance: {cite.score:.0%}\n"
-            )
-            snippet = cite.text_snippet[:200].replace("\n", " ")
-            if len(cite.text_snippet) > 200:
+            year_str = " (%s)" % cite.year if cite.year else ""
+            refs[pos] = _REF_TPL % (i, cite.title, cite.authors, year_str, cite.page, cite.score * 100)
+            snippet = cite.text_snippet[:201]
+            truncated = len(snippet) == 201
+            snippet = snippet[:200].replace("\n", " ")
+            if truncated:
                 snippet += "..."
-            refs.append(f"> {snippet}\n\n")
+            refs[pos + 1] = _SNIPPET_TPL % snippet
+            pos += 2
         
         return answer + "\n".join(refs)
     
     return answer
 
 
-def query_rag(question: str, history: list):
+async def query_rag(question: str, history: list):
     global rag_engine
     
     if history is None:
         history = []
     
     if rag_engine is None:
-        return history + [
+        yield history + [
             {"role": "user", "content": question},
             {"role": "assistant", "content": "❌ 请先点击 'Load Engine' 按钮加载 RAG 引擎"}
         ]
+        return
     
     if not question.strip():
-        return history
+        yield history
+        return
     
+    history = history + [{"role": "user", "content": question}]
     try:
-        response = rag_engine.query(question)
-        answer = format_response(response)
-        return history + [
-            {"role": "user", "content": question},
-            {"role": "assistant", "content": answer}
-        ]
+        # 边生成边刷新对话框，生成结束后再附上引用
+        response = None
+        async for response in rag_engine.astream_query(question):
+            yield history + [{"role": "assistant", "content": response.answer}]
+        
+        if response is not None:
+            yield history + [{"role": "assistant", "content": format_response(response)}]
     except Exception as e:
-        return history + [
-            {"role": "user", "content": question},
-            {"role": "assistant", "content": f"❌ 查询失败: {e}"}
-        ]
+        yield history + [{"role": "assistant", "content": f"❌ 查询失败: {e}"}]
 
 
-def search_documents(keywords: str) -> str:
+async def search_documents(keywords: str) -> str:
     global rag_engine
     
     if rag_engine is None:
@@ -94,7 +115,7 @@ def search_documents(keywords: str) -> str:
         return "请输入关键词"
     
     try:
-        citations = rag_engine.retrieve_only(keywords, top_k=10)
+        citations = await rag_engine.aretrieve_only(keywords, top_k=10)
         
         if not citations:
             return "未找到相关文档"
@@ -114,28 +135,20 @@ def search_documents(keywords: str) -> str:
         return f"❌ 检索失败: {e}"
 
 
-def reindex_documents(force: bool = False) -> str:
-    global config, rag_engine
-    
-    if config is None:
-        config = load_config()
-    
+async def reindex_documents(force: bool = False) -> str:
     try:
-        count = index_papers(config, force=force)
-        rag_engine = ZoteroRAG(config)
+        config = load_config()
+        count = await asyncio.to_thread(index_papers, config, force=force)
+        # 已加载的引擎只重新打开向量库，不重建整个 ZoteroRAG
+        await asyncio.to_thread(_refresh_rag, config)
         return f"✅ 索引完成，处理了 {count} 篇文献"
     except Exception as e:
         return f"❌ 索引失败: {e}"
 
 
-def get_stats() -> str:
-    global config
-    
-    if config is None:
-        config = load_config()
-    
+async def get_stats() -> str:
     try:
-        stats = get_index_stats(config)
+        stats = await asyncio.to_thread(get_index_stats, load_config())
         
         year_stats = ""
         if stats.get('by_year'):
@@ -261,12 +274,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", "-p", type=int, default=7860)
     parser.add_argument("--share", "-s", action="store_true")
+    parser.add_argument("--max-threads", type=int, default=16,
+                        help="同时处理的请求数 / 工作线程数")
     
     args = parser.parse_args()
     
-    config = load_config()
+    # 启动时检查配置文件
+    load_config()
     
+    # Gradio 默认每个事件同一时刻只处理一个请求，放开后多个会话才能并发
+    demo.queue(default_concurrency_limit=args.max_threads)
     demo.launch(
         server_port=args.port,
         share=args.share,
+        max_threads=args.max_threads,
     )
\ No newline at end of file
@@ -10,21 +10,62 @@ Zotero 元数据提取器
 """
 
 import sqlite3
-import json
+import html
+import pickle
 import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from typing import Optional
 from datetime import datetime
 
-import yaml
+import orjson
 from rich.console import Console
 from rich.table import Table
 
+# 可选的 C 实现 HTML 解析器，用于较长的笔记
+try:
+    from selectolax.parser import HTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
+
+try:
+    import lxml.html
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
 console = Console()
 
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_YEAR_RE = re.compile(r'(\d{4})')
+
+# 短于此长度的笔记直接用正则，解析器的初始化开销不划算
+HTML_PARSER_MIN_LEN = 512
 
-@dataclass
+
+def _strip_html(note: str) -> str:
+    """去除笔记中的 HTML 标签并还原字符实体
+    
+    长笔记优先用 selectolax / lxml（C 实现），都不可用或解析失败时用正则；
+    各路径输出一致（正则路径额外调用 html.unescape）。
+    """
+    if len(note) > HTML_PARSER_MIN_LEN:
+        try:
+            if HAS_SELECTOLAX:
+                return HTMLParser(note).text()
+            if HAS_LXML:
+                return lxml.html.fromstring(note).text_content()
+        except Exception:
+            pass
+    return html.unescape(_HTML_TAG_RE.sub('', note))
+
+
+@dataclass(slots=True)
 class PaperMetadata:
     """论文完整元数据"""
     item_key: str                          # Zotero key (8字符)
@@ -57,6 +98,16 @@ class PaperMetadata:
     attachments: list[str] = field(default_factory=list)  # PDF 文件名列表
 
 
+# 缓存格式版本：PaperMetadata 结构或缓存布局变化时递增，旧缓存自动失效
+CACHE_VERSION = 3
+_FIELD_NAMES = tuple(PaperMetadata.__dataclass_fields__)
+_CACHE_SCHEMA = (CACHE_VERSION, _FIELD_NAMES)
+
+# dict / PaperMetadata -> 按字段顺序排列的值元组，用于位置参数构造 PaperMetadata
+_field_values = itemgetter(*_FIELD_NAMES)
+_metadata_values = attrgetter(*_FIELD_NAMES)
+
+
 class ZoteroDatabase:
     """Zotero 数据库读取器"""
     
@@ -80,6 +131,12 @@ class ZoteroDatabase:
         'rights': 'rights',
     }
     
+    # 只提取 PaperMetadata 上存在对应属性的字段
+    LOADED_FIELDS = {
+        name: attr for name, attr in FIELD_MAP.items()
+        if attr in PaperMetadata.__dataclass_fields__
+    }
+    
     def __init__(self, db_path: str | Path):
         self.db_path = Path(db_path)
         if not self.db_path.exists():
@@ -87,6 +144,8 @@ class ZoteroDatabase:
         
         self.temp_db = None
         self.conn = None
+        # 附件 key -> 父条目元数据（None 表示无有效父条目）
+        self._parent_cache: dict[str, Optional[PaperMetadata]] = {}
         self._connect()
     
     def _connect(self):
@@ -104,6 +163,7 @@ class ZoteroDatabase:
             self.conn.row_factory = sqlite3.Row
             # 测试是否可读
             self.conn.execute("SELECT 1 FROM items LIMIT 1")
+            self._tune_connection(self.conn)
             return
         except sqlite3.OperationalError:
             pass
@@ -114,10 +174,50 @@ class ZoteroDatabase:
         self.temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.sqlite')
         self.temp_db.close()
         
-        shutil.copy2(self.db_path, self.temp_db.name)
-        
+        # 优先用 SQLite 在线备份：按页复制、跳过空闲页，遵循 SQLite 自身的锁，
+        # 得到一致的快照；Zotero 独占锁定数据库时备份也无法读取，退回整文件复制
         self.conn = sqlite3.connect(self.temp_db.name)
+        try:
+            src = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=5)
+            try:
+                src.backup(self.conn)
+            finally:
+                src.close()
+        except sqlite3.Error:
+            self.conn.close()
+            shutil.copy2(self.db_path, self.temp_db.name)
+            self.conn = sqlite3.connect(self.temp_db.name)
+        
         self.conn.row_factory = sqlite3.Row
+        self._tune_connection(self.conn)
+    
+    def _open_reader(self) -> sqlite3.Connection:
+        """为工作线程单独打开一条只读连接（与主连接读同一个文件）"""
+        if self.temp_db:
+            conn = sqlite3.connect(self.temp_db.name)
+        else:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro&nolock=1", uri=True, timeout=5)
+        conn.row_factory = sqlite3.Row
+        self._tune_connection(conn)
+        return conn
+    
+    @staticmethod
+    def _tune_connection(conn: sqlite3.Connection):
+        """只读场景的连接参数：64 MiB 页缓存、256 MiB mmap、临时表放内存
+        
+        不修改 journal_mode：它是数据库文件本身的持久设置，
+        不能替正在使用该库的 Zotero 改动。
+        """
+        for pragma in (
+            "PRAGMA cache_size=-65536",
+            "PRAGMA mmap_size=268435456",
+            "PRAGMA temp_store=MEMORY",
+            "PRAGMA query_only=1",
+        ):
+            try:
+                conn.execute(pragma)
+            except sqlite3.DatabaseError:
+                pass
     
     def close(self):
         if self.conn:
@@ -125,8 +225,11 @@ class ZoteroDatabase:
         if self.temp_db:
             try:
                 Path(self.temp_db.name).unlink()
-            except:
+            except FileNotFoundError:
                 pass
+            except OSError as e:
+                # Windows 上文件仍被占用时无法删除，留在临时目录由系统清理
+                console.print(f"[dim]无法删除临时数据库 {self.temp_db.name}: {e}[/dim]")
     
     def __enter__(self):
         return self
@@ -134,8 +237,21 @@ class ZoteroDatabase:
     def __exit__(self, *args):
         self.close()
     
+    # 所有有效文献条目（非附件、非笔记、未删除）的 itemID
+    PAPER_IDS_SQL = """
+        SELECT i.itemID
+        FROM items i
+        JOIN itemTypes it ON i.itemTypeID = it.itemTypeID
+        WHERE it.typeName NOT IN ('attachment', 'note', 'annotation')
+        AND i.itemID NOT IN (SELECT itemID FROM deletedItems)
+    """
+    
     def get_all_items(self) -> dict[str, PaperMetadata]:
-        """获取所有文献条目的元数据"""
+        """获取所有文献条目的元数据
+        
+        每类信息只查询一次（共 6 条 SQL），按 itemID 分发到各条目，
+        而不是对每个条目分别查询。
+        """
         cursor = self.conn.cursor()
         
         # 获取所有非附件、非笔记的条目
@@ -147,90 +263,87 @@ class ZoteroDatabase:
             AND i.itemID NOT IN (SELECT itemID FROM deletedItems)
         """)
         
-        items = {}
-        for row in cursor.fetchall():
-            item_id = row['itemID']
-            item_key = row['key']
-            item_type = row['typeName']
-            
-            metadata = PaperMetadata(item_key=item_key, item_type=item_type)
-            
-            # 获取字段值
-            self._load_fields(cursor, item_id, metadata)
-            
-            # 获取作者
-            self._load_creators(cursor, item_id, metadata)
-            
-            # 获取标签
-            self._load_tags(cursor, item_id, metadata)
-            
-            # 获取笔记
-            self._load_notes(cursor, item_id, metadata)
-            
-            # 获取附件
-            self._load_attachments(cursor, item_id, metadata)
+        by_id = {}
+        for row in cursor:
+            by_id[row['itemID']] = PaperMetadata(item_key=row['key'], item_type=row['typeName'])
+        
+        self._load_details(cursor, by_id, self.PAPER_IDS_SQL, parallel=True)
+        return {metadata.item_key: metadata for metadata in by_id.values()}
+    
+    def _load_details(self, cursor, by_id: dict[int, PaperMetadata], scope: str,
+                      params: tuple = (), parallel: bool = False):
+        """加载字段、作者、标签、笔记、附件并解析年份
+        
+        parallel=True 时五类查询各用一条独立连接在线程中并发执行
+        （sqlite3 执行查询时释放 GIL）；它们写入的是各条目的不同属性，互不冲突。
+        各连接不共享同一快照：Zotero 运行中新增的条目可能只出现在部分查询里，
+        加载函数会跳过 by_id 中没有的 itemID，留到下次提取。
+        """
+        loaders = (
+            self._load_fields,
+            self._load_creators,
+            self._load_tags,
+            self._load_notes,
+            self._load_attachments,
+        )
+        
+        if parallel:
+            def run(loader):
+                conn = self._open_reader()
+                try:
+                    loader(conn.cursor(), by_id, scope, params)
+                finally:
+                    conn.close()
             
+            with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+                # list() 取出结果，线程中的异常在这里抛出
+                list(executor.map(run, loaders))
+        else:
+            for loader in loaders:
+                loader(cursor, by_id, scope, params)
+        
+        for metadata in by_id.values():
             # 解析年份
             if metadata.date:
-                year_match = re.search(r'(\d{4})', metadata.date)
+                year_match = _YEAR_RE.search(metadata.date)
                 if year_match:
                     metadata.year = year_match.group(1)
-            
-            items[item_key] = metadata
-        
-        return items
     
-    def _load_fields(self, cursor, item_id: int, metadata: PaperMetadata):
-        """加载条目字段"""
-        cursor.execute("""
-            SELECT f.fieldName, iv.value
+    # 以下加载函数把结果写入 by_id 中对应的条目，不在 by_id 中的 itemID 直接跳过；
+    # scope 为返回 itemID 的子查询（或 "?" 配合 params 指定单个条目）。
+    # 列表字段先按 itemID 分组，最后对每个条目整体赋值一次
+    
+    def _load_fields(self, cursor, by_id: dict[int, PaperMetadata], scope: str, params: tuple = ()):
+        """加载条目字段（未映射的字段在 SQL 中就被过滤掉）"""
+        field_map = self.LOADED_FIELDS
+        cursor.execute(f"""
+            SELECT id.itemID, f.fieldName, iv.value
             FROM itemData id
             JOIN itemDataValues iv ON id.valueID = iv.valueID
             JOIN fields f ON id.fieldID = f.fieldID
-            WHERE id.itemID = ?
-        """, (item_id,))
+            WHERE f.fieldName IN ({','.join('?' * len(field_map))})
+            AND id.itemID IN ({scope})
+        """, (*field_map, *params))
         
-        for row in cursor.fetchall():
-            field_name = row['fieldName']
-            value = row['value']
-            
-            if field_name == 'title':
-                metadata.title = value
-            elif field_name == 'date':
-                metadata.date = value
-            elif field_name == 'DOI':
-                metadata.doi = value
-            elif field_name == 'url':
-                metadata.url = value
-            elif field_name == 'abstractNote':
-                metadata.abstract = value
-            elif field_name == 'publicationTitle':
-                metadata.journal = value
-            elif field_name == 'volume':
-                metadata.volume = value
-            elif field_name == 'issue':
-                metadata.issue = value
-            elif field_name == 'pages':
-                metadata.pages = value
-            elif field_name == 'ISBN':
-                metadata.isbn = value
-            elif field_name == 'ISSN':
-                metadata.issn = value
-    
-    def _load_creators(self, cursor, item_id: int, metadata: PaperMetadata):
+        for item_id, field_name, value in cursor:
+            if (metadata := by_id.get(item_id)) is not None:
+                setattr(metadata, field_map[field_name], value)
+    
+    def _load_creators(self, cursor, by_id: dict[int, PaperMetadata], scope: str, params: tuple = ()):
         """加载作者信息"""
-        cursor.execute("""
-            SELECT c.firstName, c.lastName, ct.creatorType
+        cursor.execute(f"""
+            SELECT ic.itemID, c.firstName, c.lastName, ct.creatorType
             FROM itemCreators ic
             JOIN creators c ON ic.creatorID = c.creatorID
             JOIN creatorTypes ct ON ic.creatorTypeID = ct.creatorTypeID
-            WHERE ic.itemID = ?
-            ORDER BY ic.orderIndex
-        """, (item_id,))
+            WHERE ic.itemID IN ({scope})
+            ORDER BY ic.itemID, ic.orderIndex
+        """, params)
         
-        for row in cursor.fetchall():
-            first = row['firstName'] or ""
-            last = row['lastName'] or ""
+        authors_by_item: dict[int, list[str]] = {}
+        for item_id, first, last, _ in cursor:
+            first = first or ""
+            last = last or ""
             
             if first and last:
                 name = f"{first} {last}"
@@ -238,60 +351,80 @@ class ZoteroDatabase:
                 name = last or first
             
             if name:
-                metadata.authors.append(name)
+                authors_by_item.setdefault(item_id, []).append(name)
+        
+        for item_id, authors in authors_by_item.items():
+            if (metadata := by_id.get(item_id)) is not None:
+                metadata.authors = authors
     
-    def _load_tags(self, cursor, item_id: int, metadata: PaperMetadata):
+    def _load_tags(self, cursor, by_id: dict[int, PaperMetadata], scope: str, params: tuple = ()):
         """加载标签"""
-        cursor.execute("""
-            SELECT t.name
+        cursor.execute(f"""
+            SELECT it.itemID, t.name
             FROM itemTags it
             JOIN tags t ON it.tagID = t.tagID
-            WHERE it.itemID = ?
-        """, (item_id,))
+            WHERE it.itemID IN ({scope})
+        """, params)
+        
+        tags_by_item: dict[int, list[str]] = {}
+        for item_id, name in cursor:
+            tags_by_item.setdefault(item_id, []).append(name)
         
-        for row in cursor.fetchall():
-            metadata.tags.append(row['name'])
+        for item_id, tags in tags_by_item.items():
+            if (metadata := by_id.get(item_id)) is not None:
+                metadata.tags = tags
     
-    def _load_notes(self, cursor, item_id: int, metadata: PaperMetadata):
+    def _load_notes(self, cursor, by_id: dict[int, PaperMetadata], scope: str, params: tuple = ()):
         """加载笔记"""
-        cursor.execute("""
-            SELECT in2.note
+        cursor.execute(f"""
+            SELECT in2.parentItemID, in2.note
             FROM itemNotes in2
             JOIN items i ON in2.itemID = i.itemID
-            WHERE in2.parentItemID = ?
+            WHERE in2.parentItemID IN ({scope})
             AND i.itemID NOT IN (SELECT itemID FROM deletedItems)
-        """, (item_id,))
+        """, params)
         
-        for row in cursor.fetchall():
-            note = row['note']
+        notes_by_item: dict[int, list[str]] = {}
+        for item_id, note in cursor:
             if note:
                 # 移除 HTML 标签
-                clean_note = re.sub(r'<[^>]+>', '', note)
-                clean_note = clean_note.strip()
+                clean_note = _strip_html(note).strip()
                 if clean_note:
-                    metadata.notes.append(clean_note)
+                    notes_by_item.setdefault(item_id, []).append(clean_note)
+        
+        for item_id, notes in notes_by_item.items():
+            if (metadata := by_id.get(item_id)) is not None:
+                metadata.notes = notes
     
-    def _load_attachments(self, cursor, item_id: int, metadata: PaperMetadata):
+    def _load_attachments(self, cursor, by_id: dict[int, PaperMetadata], scope: str, params: tuple = ()):
         """加载附件信息"""
-        cursor.execute("""
-            SELECT ia.path, i.key
+        cursor.execute(f"""
+            SELECT ia.parentItemID, ia.path, i.key
             FROM itemAttachments ia
             JOIN items i ON ia.itemID = i.itemID
-            WHERE ia.parentItemID = ?
+            WHERE ia.parentItemID IN ({scope})
             AND i.itemID NOT IN (SELECT itemID FROM deletedItems)
-        """, (item_id,))
+        """, params)
         
-        for row in cursor.fetchall():
-            path = row['path']
-            key = row['key']
+        attachments_by_item: dict[int, list[str]] = {}
+        for item_id, path, key in cursor:
             if path:
                 # path 格式: "storage:filename.pdf"
                 if path.startswith('storage:'):
                     filename = path[8:]
-                    metadata.attachments.append(f"{key}/{filename}")
+                    attachments_by_item.setdefault(item_id, []).append(f"{key}/{filename}")
+        
+        for item_id, attachments in attachments_by_item.items():
+            if (metadata := by_id.get(item_id)) is not None:
+                metadata.attachments = attachments
     
     def get_item_by_attachment_key(self, attachment_key: str) -> Optional[PaperMetadata]:
-        """通过附件 key 获取父条目元数据"""
+        """通过附件 key 获取父条目元数据（结果按附件 key 缓存）"""
+        if attachment_key not in self._parent_cache:
+            self._parent_cache[attachment_key] = self._query_parent_item(attachment_key)
+        return self._parent_cache[attachment_key]
+    
+    def _query_parent_item(self, attachment_key: str) -> Optional[PaperMetadata]:
         cursor = self.conn.cursor()
         
         # 查找附件的父条目
@@ -308,23 +441,41 @@ class ZoteroDatabase:
         
         parent_id = row['parentItemID']
         
-        # 获取父条目的 key
-        cursor.execute("SELECT key FROM items WHERE itemID = ?", (parent_id,))
+        # 获取父条目的 key（与 get_all_items 相同的范围：非附件、非笔记、未删除）
+        cursor.execute(f"""
+            SELECT i.key, it.typeName
+            FROM items i
+            JOIN itemTypes it ON i.itemTypeID = it.itemTypeID
+            WHERE i.itemID = ?
+            AND i.itemID IN ({self.PAPER_IDS_SQL})
+        """, (parent_id,))
         row = cursor.fetchone()
         if not row:
             return None
         
-        parent_key = row['key']
-        
-        # 获取完整元数据
-        all_items = self.get_all_items()
-        return all_items.get(parent_key)
+        # 只加载这一个条目的元数据
+        by_id = {parent_id: PaperMetadata(item_key=row['key'], item_type=row['typeName'])}
+        self._load_details(cursor, by_id, "?", (parent_id,))
+        return by_id[parent_id]
 
 
-def find_zotero_database() -> Optional[Path]:
-    """自动查找 Zotero 数据库位置"""
+def find_zotero_database(cache_dir: Optional[Path] = None) -> Optional[Path]:
+    """自动查找 Zotero 数据库位置
+    
+    指定 cache_dir 时把找到的路径记录在 cache_dir/.zotero_db_path，
+    下次先检查记录的路径，仍然存在就不再逐个探测候选位置。
+    """
     import platform
     
+    record = Path(cache_dir) / ".zotero_db_path" if cache_dir is not None else None
+    if record is not None:
+        try:
+            cached = Path(record.read_text(encoding="utf-8").strip())
+            if cached.is_file():
+                return cached
+        except OSError:
+            pass
+    
     system = platform.system()
     
     candidates = []
@@ -357,28 +508,65 @@ def find_zotero_database() -> Optional[Path]:
     
     for path in candidates:
         if path.exists():
+            if record is not None:
+                try:
+                    record.write_text(str(path), encoding="utf-8")
+                except OSError:
+                    pass
             return path
     
     return None
 
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+def _load_cache(cache_file: Path) -> Optional[dict[str, PaperMetadata]]:
+    """读取 pickle 缓存（由本程序写入 cache_dir）；文件损坏或格式版本不符时返回 None
+    
+    缓存中只有内置类型（按字段顺序的值元组），不引用 PaperMetadata 所在模块：
+    直接运行 zotero_meta.py 时该类属于 __main__，pickle 对象会让 indexer 无法读取。
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            schema, rows = pickle.load(f)
+        if schema != _CACHE_SCHEMA:
+            return None
+        return {k: PaperMetadata(*values) for k, values in rows.items()}
+    except Exception as e:
+        console.print(f"[yellow]元数据缓存读取失败，将重新提取: {cache_file} ({e})[/yellow]")
+        return None
 
 
-def extract_and_cache_metadata(config: dict, force: bool = False) -> dict[str, PaperMetadata]:
-    """提取元数据并缓存"""
+def _load_json_export(export_file: Path) -> Optional[dict[str, PaperMetadata]]:
+    """读取 JSON 导出副本（旧版本的缓存格式）；字段不全或损坏时返回 None
+    
+    按字段顺序取值后位置传参构造，不为每条记录构建关键字参数字典。
+    """
+    try:
+        data = orjson.loads(export_file.read_bytes())
+        return {k: PaperMetadata(*_field_values(v)) for k, v in data.items()}
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _file_mtime(path: Path) -> float:
+    """文件修改时间，不存在时返回 -1"""
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return -1.0
+
+
+def _database_mtime(db_path: Path) -> float:
+    """数据库的最后修改时间：WAL 模式下新写入先落在 -wal 文件中，一并考虑"""
+    return max(_file_mtime(db_path), _file_mtime(db_path.with_name(db_path.name + "-wal")))
+
+
+def extract_and_cache_metadata(config: dict, force: bool = False, pretty: bool = False) -> dict[str, PaperMetadata]:
+    """提取元数据并缓存（pretty=True 时 JSON 导出副本带缩进，便于人工查看）"""
     cache_dir = Path(config["paths"]["cache_dir"])
     cache_dir.mkdir(parents=True, exist_ok=True)
-    cache_file = cache_dir / "zotero_metadata.json"
-    
-    # 如果缓存存在且不强制刷新
-    if not force and cache_file.exists():
-        console.print(f"[dim]从缓存加载元数据: {cache_file}[/dim]")
-        with open(cache_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return {k: PaperMetadata(**v) for k, v in data.items()}
+    cache_file = cache_dir / "zotero_metadata.pkl"
+    # JSON 仅作为便于查看的导出副本；旧版本只有 JSON 缓存时仍可读取
+    export_file = cache_dir / "zotero_metadata.json"
     
     # 查找数据库
     zotero_config = config.get("zotero", {})
@@ -389,18 +577,38 @@ def extract_and_cache_metadata(config: dict, force: bool = False) -> dict[str, P
         data_dir = Path(zotero_config.get("data_dir", "~/Zotero")).expanduser()
         db_path = data_dir / "zotero.sqlite"
     
+    auto_found = False
     if not db_path.exists():
         # 尝试自动查找
-        found = find_zotero_database()
-        if found:
-            db_path = found
-            console.print(f"[green]自动找到数据库: {db_path}[/green]")
-        else:
-            console.print("[red]找不到 Zotero 数据库[/red]")
-            console.print("请在 config.yaml 中设置正确的路径：")
-            console.print("  zotero:")
-            console.print("    database: C:/Users/你的用户名/Zotero/zotero.sqlite")
-            return {}
+        db_path = find_zotero_database(cache_dir)
+        auto_found = db_path is not None
+    
+    # 缓存不早于数据库的最后修改时间且不强制刷新时直接复用；
+    # 找不到数据库时无法判断新旧，有缓存就用缓存
+    if not force:
+        db_mtime = _database_mtime(db_path) if db_path is not None else 0.0
+        
+        if _file_mtime(cache_file) >= db_mtime:
+            items = _load_cache(cache_file)
+            if items is not None:
+                console.print(f"[dim]从缓存加载元数据: {cache_file}[/dim]")
+                return items
+        
+        if _file_mtime(export_file) >= db_mtime:
+            items = _load_json_export(export_file)
+            if items is not None:
+                console.print(f"[dim]从缓存加载元数据: {export_file}[/dim]")
+                return items
+    
+    if db_path is None:
+        console.print("[red]找不到 Zotero 数据库[/red]")
+        console.print("请在 config.yaml 中设置正确的路径：")
+        console.print("  zotero:")
+        console.print("    database: C:/Users/你的用户名/Zotero/zotero.sqlite")
+        return {}
+    
+    if auto_found:
+        console.print(f"[green]自动找到数据库: {db_path}[/green]")
     
     console.print(f"[bold blue]读取 Zotero 数据库: {db_path}[/bold blue]")
     
@@ -409,9 +617,15 @@ def extract_and_cache_metadata(config: dict, force: bool = False) -> dict[str, P
     
     console.print(f"[green]提取了 {len(items)} 条文献元数据[/green]")
     
-    # 缓存到文件
-    with open(cache_file, "w", encoding="utf-8") as f:
-        json.dump({k: asdict(v) for k, v in items.items()}, f, ensure_ascii=False, indent=2)
+    # 缓存到文件：每条记录存为值元组，读取时位置传参重建，不依赖类的模块路径
+    rows = {k: _metadata_values(metadata) for k, metadata in items.items()}
+    tmp_file = cache_file.with_suffix(".pkl.tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump((_CACHE_SCHEMA, rows), f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_file.replace(cache_file)
+    
+    # orjson 原生支持 dataclass，无需先转成 dict；默认不缩进
+    export_file.write_bytes(orjson.dumps(items, option=orjson.OPT_INDENT_2 if pretty else 0))
     
     console.print(f"[dim]已缓存到: {cache_file}[/dim]")
     
@@ -420,26 +634,30 @@ def extract_and_cache_metadata(config: dict, force: bool = False) -> dict[str, P
 
 def build_attachment_mapping(items: dict[str, PaperMetadata]) -> dict[str, PaperMetadata]:
     """构建附件 key 到元数据的映射"""
-    mapping = {}
-    
-    for item_key, metadata in items.items():
-        for attachment in metadata.attachments:
-            # attachment 格式: "XXXXXXXX/filename.pdf"
-            att_key = attachment.split('/')[0]
-            mapping[att_key] = metadata
-    
-    return mapping
+    # attachment 格式: "XXXXXXXX/filename.pdf"；partition 不会为取前缀而分配列表
+    return {
+        attachment.partition('/')[0]: metadata
+        for metadata in items.values()
+        for attachment in metadata.attachments
+    }
 
 
 def print_metadata_stats(items: dict[str, PaperMetadata]):
     """打印元数据统计"""
     
-    # 统计
-    has_abstract = sum(1 for m in items.values() if m.abstract)
-    has_doi = sum(1 for m in items.values() if m.doi)
-    has_journal = sum(1 for m in items.values() if m.journal)
-    has_tags = sum(1 for m in items.values() if m.tags)
-    has_notes = sum(1 for m in items.values() if m.notes)
+    # 统计（一次遍历同时统计完整度和文献类型）
+    has_abstract = has_doi = has_journal = has_tags = has_notes = 0
+    item_types = []
+    for m in items.values():
+        has_abstract += bool(m.abstract)
+        has_doi += bool(m.doi)
+        has_journal += bool(m.journal)
+        has_tags += bool(m.tags)
+        has_notes += bool(m.notes)
+        item_types.append(m.item_type or "unknown")
+    
+    # Counter 的计数循环由 C 实现
+    types = Counter(item_types)
     
     total = len(items)
     
@@ -459,11 +677,6 @@ def print_metadata_stats(items: dict[str, PaperMetadata]):
     console.print(table)
     
     # 按类型统计
-    types = {}
-    for m in items.values():
-        t = m.item_type or "unknown"
-        types[t] = types.get(t, 0) + 1
-    
     console.print("\n[bold]文献类型统计:[/bold]")
     for t, count in sorted(types.items(), key=lambda x: -x[1]):
         console.print(f"  {t}: {count}")
@@ -473,7 +686,7 @@ def show_sample_items(items: dict[str, PaperMetadata], n: int = 3):
     """显示示例条目"""
     console.print(f"\n[bold]示例条目 (前 {n} 条):[/bold]\n")
     
-    for i, (key, meta) in enumerate(list(items.items())[:n]):
+    for i, (key, meta) in enumerate(islice(items.items(), n)):
         console.print(f"[cyan]── {key} ──[/cyan]")
         console.print(f"  标题: {meta.title[:60]}{'...' if len(meta.title) > 60 else ''}")
         console.print(f"  作者: {', '.join(meta.authors[:3])}{'...' if len(meta.authors) > 3 else ''}")
@@ -494,11 +707,15 @@ def show_sample_items(items: dict[str, PaperMetadata], n: int = 3):
 if __name__ == "__main__":
     import argparse
     
+    # 配置加载与其他脚本共用；只在命令行入口导入，indexer 导入本模块时不受影响
+    from rag_utils import load_config
+    
     parser = argparse.ArgumentParser(description="提取 Zotero 元数据")
     parser.add_argument("--config", "-c", default="config.yaml", help="配置文件路径")
     parser.add_argument("--force", "-f", action="store_true", help="强制刷新缓存")
     parser.add_argument("--sample", "-s", type=int, default=3, help="显示示例数量")
     parser.add_argument("--db", type=str, help="直接指定数据库路径")
+    parser.add_argument("--pretty", action="store_true", help="JSON 导出副本带缩进（便于查看）")
     
     args = parser.parse_args()
     
@@ -507,7 +724,7 @@ if __name__ == "__main__":
     if args.db:
         config.setdefault("zotero", {})["database"] = args.db
     
-    items = extract_and_cache_metadata(config, force=args.force)
+    items = extract_and_cache_metadata(config, force=args.force, pretty=args.pretty)
     
     if items:
         print_metadata_stats(items)